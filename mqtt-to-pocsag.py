@@ -2,19 +2,34 @@
 
 import paho.mqtt.client as mqtt
 import requests
-import json
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+import orjson
 import base64
 import sqlite3
+import struct
 import logging
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
 import time
+import atexit
 import signal
 import sys
 import threading
+import queue
 import os
+import re
+import itertools
+import functools
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from dotenv import load_dotenv
 from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
 from cryptography.hazmat.backends import default_backend
+
+# Prefer the native protobuf parser; must be set before google.protobuf is imported
+os.environ.setdefault("PROTOCOL_BUFFERS_PYTHON_IMPLEMENTATION", "upb")
+from google.protobuf.internal import api_implementation
 from meshtastic import (
     mesh_pb2,
     mqtt_pb2,
@@ -30,41 +45,82 @@ load_dotenv()
 shutdown_event = threading.Event()
 mqtt_client = None
 db_connection = None
+log_listener = None
 
-def check_and_rotate_log(log_file_path, max_size_mb=10):
-    """Check log file size and rotate if it exceeds max_size_mb"""
-    try:
-        if os.path.exists(log_file_path):
-            file_size_mb = os.path.getsize(log_file_path) / (1024 * 1024)
-            if file_size_mb >= max_size_mb:
-                # Clear the log file by truncating it
-                with open(log_file_path, 'w') as f:
-                    f.write("")
-                print(f"Log file rotated: {log_file_path} (was {file_size_mb:.2f}MB)")
-                return True
-        return False
-    except Exception as e:
-        print(f"Error checking/rotating log file: {e}")
-        return False
+# Worker pool for packet decoding, keeps the paho network thread free for socket I/O;
+# worker_slots caps packets submitted but not yet processed at WORKER_QUEUE_SIZE
+message_workers = None
+worker_slots = None
+
+# Outgoing DAPNET messages, delivered by dapnet_worker so MQTT callbacks never block on HTTP
+# Bounded by DAPNET_QUEUE_SIZE so a DAPNET outage cannot grow memory without limit
+dapnet_queue = None
+dapnet_thread = None
+
+# Pending (sql, params) writes, applied in batches by database_writer on its own connection;
+# batch size and interval come from DB_BATCH_SIZE / DB_BATCH_INTERVAL_MS, and the
+# backlog is bounded by DB_QUEUE_SIZE so a stalled writer cannot grow memory without limit
+db_write_queue = None
+db_writer_thread = None
+db_writer_stop = threading.Event()
+DB_CACHED_STATEMENTS = 256
+
+# Quoted node table name and its write statements, built once by setup_database
+NODE_TABLE = None
+UPSERT_NODEINFO_SQL = None
+UPSERT_POSITION_SQL = None
+
+# AES cipher algorithm for the decoded key, set once by prepare_encryption_key
+AES_ALGORITHM = None
+CRYPTO_BACKEND = default_backend()
+
+# AES-CTR nonce layout: packet id and sender, both little-endian 64-bit
+NONCE_STRUCT = struct.Struct("<QQ")
+
+# Recently forwarded (packet id, sender) pairs, used to drop mesh rebroadcasts
+seen_messages = OrderedDict()
+seen_messages_lock = threading.Lock()
+SEEN_MESSAGES_MAX = 4096
+SEEN_MESSAGES_TTL = 60
+
+# Decoded payload types acted upon (HANDLE_PORTNUMS); anything else is dropped right after decryption
+HANDLED_PORTNUMS = frozenset()
+
+# Port numbers dispatched in decode_encrypted, bound once to skip module attribute lookups per packet
+TEXT_MESSAGE_APP = portnums_pb2.TEXT_MESSAGE_APP
+NODEINFO_APP = portnums_pb2.NODEINFO_APP
+POSITION_APP = portnums_pb2.POSITION_APP
+
+# Per-thread scratch buffers and protobuf messages reused on the decoding hot path
+_tls = threading.local()
 
 # Configure logging with rotation and console output
 def setup_logging():
     """Setup comprehensive logging with both file and console output"""
+    global log_listener
+    
     try:
         log_file = os.getenv('LOG_FILE', 'meshtastic_debug.log')
+        log_level_name = os.getenv('LOG_LEVEL', 'INFO').upper()
+        log_level = logging.getLevelName(log_level_name)
+        if not isinstance(log_level, int):
+            print(f"WARNING: Unknown LOG_LEVEL '{log_level_name}', using INFO")
+            log_level = logging.INFO
         
-        # Check and rotate log file if needed
-        check_and_rotate_log(log_file, max_size_mb=10)
-        
-        # Create logger
+        # Create logger; below DEBUG level, debug calls are dropped before any formatting
         logger = logging.getLogger()
-        logger.setLevel(logging.DEBUG)
+        logger.setLevel(log_level)
         
         # Clear any existing handlers
         logger.handlers.clear()
         
-        # File handler
-        file_handler = logging.FileHandler(log_file, mode="a")
+        # File handler, rotated at 10MB
+        file_handler = RotatingFileHandler(
+            log_file,
+            mode="a",
+            maxBytes=10 * 1024 * 1024,
+            backupCount=5
+        )
         file_handler.setLevel(logging.DEBUG)
         
         # Console handler for immediate feedback
@@ -78,9 +134,19 @@ def setup_logging():
         file_handler.setFormatter(formatter)
         console_handler.setFormatter(formatter)
         
-        # Add handlers
-        logger.addHandler(file_handler)
-        logger.addHandler(console_handler)
+        # Callers only enqueue records; a listener thread does the actual I/O
+        log_queue = queue.Queue(-1)
+        logger.addHandler(QueueHandler(log_queue))
+        log_listener = QueueListener(
+            log_queue,
+            file_handler,
+            console_handler,
+            respect_handler_level=True
+        )
+        log_listener.start()
+        
+        # Flush queued records on any normal interpreter exit
+        atexit.register(log_listener.stop)
         
         logging.info("Logging system initialized successfully")
         return True
@@ -88,20 +154,6 @@ def setup_logging():
         print(f"CRITICAL: Failed to setup logging: {e}")
         return False
 
-def periodic_log_check():
-    """Periodically check and rotate log file if needed"""
-    log_file = os.getenv('LOG_FILE', 'meshtastic_debug.log')
-    while not shutdown_event.is_set():
-        try:
-            if check_and_rotate_log(log_file, max_size_mb=10):
-                # Re-setup logging after rotation
-                setup_logging()
-                logging.info("Log file was rotated and logging reinitialized")
-            time.sleep(60)  # Check every minute
-        except Exception as e:
-            print(f"Error in periodic log check: {e}")
-            time.sleep(60)
-
 # Initialize logging first
 if not setup_logging():
     sys.exit(1)
@@ -119,6 +171,7 @@ def load_config_from_env():
         # MQTT Topic settings
         "root_topic": os.getenv('ROOT_TOPIC', 'msh/MY_919/2/e/'),
         "channel": os.getenv('CHANNEL', 'LongFast'),
+        "gateway_id": os.getenv('GATEWAY_ID', ''),
         
         # MQTT Connection settings
         "mqtt_broker": os.getenv('MQTT_BROKER', ''),
@@ -139,9 +192,20 @@ def load_config_from_env():
         "max_retries": int(os.getenv('MAX_RETRIES', '5')),
         "retry_delay": int(os.getenv('RETRY_DELAY', '5')),
         "api_timeout": int(os.getenv('API_TIMEOUT', '30')),
+        "worker_threads": int(os.getenv('WORKER_THREADS', '1')),
+        "worker_queue_size": int(os.getenv('WORKER_QUEUE_SIZE', '1000')),
+        "dapnet_queue_size": int(os.getenv('DAPNET_QUEUE_SIZE', '100')),
+        "handle_portnums": [
+            name.strip().upper()
+            for name in os.getenv('HANDLE_PORTNUMS', 'TEXT_MESSAGE_APP,NODEINFO_APP,POSITION_APP').split(',')
+            if name.strip()
+        ],
         
         # Database settings
         "database_file": os.getenv('DATABASE_FILE', 'meshtastic.db'),
+        "db_batch_size": int(os.getenv('DB_BATCH_SIZE', '200')),
+        "db_batch_interval_ms": int(os.getenv('DB_BATCH_INTERVAL_MS', '50')),
+        "db_queue_size": int(os.getenv('DB_QUEUE_SIZE', '10000')),
         
         # Logging settings
         "log_file": os.getenv('LOG_FILE', 'meshtastic_debug.log'),
@@ -154,6 +218,24 @@ def load_config_from_env():
 # Load configuration
 CONFIG = load_config_from_env()
 
+def create_dapnet_session():
+    """Create a persistent HTTP session so DAPNET calls reuse keep-alive connections"""
+    session = requests.Session()
+    session.auth = (CONFIG["callsign"], CONFIG["dapnet_password"])
+    session.headers.update({"Content-Type": "application/json"})
+    
+    # send_to_dapnet_pocsag owns request retries; the adapter only quickly retries failures to
+    # open a new connection, which never reach the server (a dropped keep-alive socket is a read
+    # error and is left to send_to_dapnet_pocsag)
+    connect_retry = Retry(total=2, connect=2, read=0, status=0, other=0, backoff_factor=0.2)
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=4, max_retries=connect_retry)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    
+    return session
+
+DAPNET_SESSION = create_dapnet_session()
+
 def validate_config():
     """Validate configuration parameters"""
     try:
@@ -185,6 +267,15 @@ def validate_config():
         except Exception as e:
             raise ValueError(f"Invalid encryption key format in ENCRYPTION_KEY: {e}")
         
+        # Validate channel, which names both the MQTT topic level and the database table
+        if not re.fullmatch(r"[A-Za-z0-9_]+", CONFIG["channel"]):
+            raise ValueError("CHANNEL may only contain letters, digits and underscores")
+        
+        # Validate gateway filter, which becomes a single MQTT topic level
+        gateway_id = CONFIG["gateway_id"]
+        if gateway_id and (not gateway_id.startswith("!") or any(c in gateway_id for c in "/+#")):
+            raise ValueError("GATEWAY_ID must be a single gateway node ID such as !a1b2c3d4")
+        
         # Validate numeric values
         if CONFIG["mqtt_port"] <= 0 or CONFIG["mqtt_port"] > 65535:
             raise ValueError("MQTT_PORT must be between 1 and 65535")
@@ -198,6 +289,35 @@ def validate_config():
         if CONFIG["api_timeout"] <= 0:
             raise ValueError("API_TIMEOUT must be greater than 0")
         
+        if CONFIG["worker_threads"] <= 0:
+            raise ValueError("WORKER_THREADS must be greater than 0")
+        
+        if CONFIG["worker_queue_size"] <= 0:
+            raise ValueError("WORKER_QUEUE_SIZE must be greater than 0")
+        
+        if CONFIG["dapnet_queue_size"] <= 0:
+            raise ValueError("DAPNET_QUEUE_SIZE must be greater than 0")
+        
+        # Validate handled payload types
+        supported_portnums = {"TEXT_MESSAGE_APP", "NODEINFO_APP", "POSITION_APP"}
+        if not CONFIG["handle_portnums"]:
+            raise ValueError("HANDLE_PORTNUMS must list at least one payload type")
+        unsupported = [name for name in CONFIG["handle_portnums"] if name not in supported_portnums]
+        if unsupported:
+            raise ValueError(
+                f"Unsupported HANDLE_PORTNUMS entries: {', '.join(unsupported)} "
+                f"(supported: {', '.join(sorted(supported_portnums))})"
+            )
+        
+        if CONFIG["db_batch_size"] <= 0:
+            raise ValueError("DB_BATCH_SIZE must be greater than 0")
+        
+        if CONFIG["db_batch_interval_ms"] <= 0:
+            raise ValueError("DB_BATCH_INTERVAL_MS must be greater than 0")
+        
+        if CONFIG["db_queue_size"] <= 0:
+            raise ValueError("DB_QUEUE_SIZE must be greater than 0")
+        
         logging.info("Configuration validation successful")
         return True
         
@@ -208,6 +328,8 @@ def validate_config():
 
 def prepare_encryption_key():
     """Prepare and validate encryption key"""
+    global AES_ALGORITHM
+    
     try:
         key = CONFIG["encryption_key"]
         padded_key = key.ljust(len(key) + ((4 - (len(key) % 4)) % 4), "=")
@@ -217,45 +339,121 @@ def prepare_encryption_key():
         key_bytes = base64.b64decode(replaced_key.encode("ascii"))
         logging.info(f"Encryption key prepared successfully (length: {len(key_bytes)} bytes)")
         
-        return replaced_key
+        # The key never changes, so decode it once instead of per packet
+        AES_ALGORITHM = algorithms.AES(key_bytes)
     except Exception as e:
         logging.error(f"Failed to prepare encryption key: {e}")
         raise
 
+def prepare_portnum_filter():
+    """Resolve HANDLE_PORTNUMS names to Meshtastic port numbers"""
+    global HANDLED_PORTNUMS
+    
+    HANDLED_PORTNUMS = frozenset(
+        portnums_pb2.PortNum.Value(name) for name in CONFIG["handle_portnums"]
+    )
+    logging.info(f"Handling payload types: {', '.join(CONFIG['handle_portnums'])}")
+
+def configure_connection(connection):
+    """Apply WAL mode and write-friendly PRAGMAs to a database connection"""
+    # Enable WAL mode for better concurrency and keep bursty writes in memory
+    connection.executescript("""
+        PRAGMA journal_mode=WAL;
+        PRAGMA synchronous=NORMAL;
+        PRAGMA temp_store=MEMORY;
+        PRAGMA mmap_size=268435456;
+        PRAGMA cache_size=-65536;
+        PRAGMA wal_autocheckpoint=1000;
+    """)
+
+def quote_identifier(name):
+    """Quote an SQL identifier using SQLite's double-quote escaping rules"""
+    return '"' + name.replace('"', '""') + '"'
+
+def node_table_ddl(table, if_not_exists=False):
+    """Build the CREATE TABLE statement for a node table"""
+    # Lookups are always by client_id, so the primary key B-tree holds the rows directly
+    return f"""CREATE TABLE {'IF NOT EXISTS ' if if_not_exists else ''}{table} (
+                client_id TEXT PRIMARY KEY NOT NULL,
+                long_name TEXT,
+                short_name TEXT,
+                macaddr TEXT,
+                latitude_i TEXT,
+                longitude_i TEXT,
+                altitude TEXT,
+                precision_bits TEXT,
+                last_updated TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            ) WITHOUT ROWID"""
+
+def migrate_node_table_without_rowid(connection):
+    """Rebuild a node table created by older versions as a WITHOUT ROWID table"""
+    row = connection.execute(
+        "SELECT sql FROM sqlite_master WHERE type = 'table' AND name = ?",
+        (CONFIG["channel"],)
+    ).fetchone()
+    if row is None or "WITHOUT ROWID" in row[0].upper():
+        return
+    
+    logging.info(f"Migrating table {NODE_TABLE} to WITHOUT ROWID...")
+    
+    columns = (
+        "client_id, long_name, short_name, macaddr, latitude_i, "
+        "longitude_i, altitude, precision_bits, last_updated"
+    )
+    # CHANNEL cannot contain "-", so this name never collides with another channel's table
+    new_table = quote_identifier(CONFIG["channel"] + "-rebuild")
+    connection.executescript(f"""
+        BEGIN;
+        DROP TABLE IF EXISTS {new_table};
+        {node_table_ddl(new_table)};
+        INSERT INTO {new_table} ({columns}) SELECT {columns} FROM {NODE_TABLE};
+        DROP TABLE {NODE_TABLE};
+        ALTER TABLE {new_table} RENAME TO {NODE_TABLE};
+        COMMIT;
+    """)
+    
+    logging.info(f"Table {NODE_TABLE} migrated to WITHOUT ROWID")
+
 def setup_database():
-    """Setup database with proper error handling"""
-    global db_connection
+    """Setup database schema with proper error handling"""
+    global NODE_TABLE, UPSERT_NODEINFO_SQL, UPSERT_POSITION_SQL
     
     try:
-        logging.info("Setting up database connection...")
-        
-        # Create connection with timeout and error handling
-        db_connection = sqlite3.connect(
-            CONFIG["database_file"], 
-            timeout=30.0,
-            check_same_thread=False
-        )
-        
-        # Enable WAL mode for better concurrency
-        db_connection.execute("PRAGMA journal_mode=WAL")
-        db_connection.execute("PRAGMA synchronous=NORMAL")
-        
-        cursor = db_connection.cursor()
+        logging.info("Setting up database...")
+        
+        # Resolve the channel table and its statements once, not per write
+        NODE_TABLE = quote_identifier(CONFIG["channel"])
+        
+        # Partial updates keep the columns written by the other packet type
+        UPSERT_NODEINFO_SQL = f"""INSERT INTO {NODE_TABLE} (
+                                    client_id, long_name, short_name, macaddr
+                                ) VALUES (?, ?, ?, ?)
+                                ON CONFLICT(client_id) DO UPDATE SET
+                                    long_name = excluded.long_name,
+                                    short_name = excluded.short_name,
+                                    macaddr = excluded.macaddr,
+                                    last_updated = CURRENT_TIMESTAMP"""
+        UPSERT_POSITION_SQL = f"""INSERT INTO {NODE_TABLE} (
+                                    client_id, latitude_i, longitude_i, altitude, precision_bits
+                                ) VALUES (?, ?, ?, ?, ?)
+                                ON CONFLICT(client_id) DO UPDATE SET
+                                    latitude_i = excluded.latitude_i,
+                                    longitude_i = excluded.longitude_i,
+                                    altitude = excluded.altitude,
+                                    precision_bits = excluded.precision_bits,
+                                    last_updated = CURRENT_TIMESTAMP"""
+        
+        connection = sqlite3.connect(CONFIG["database_file"], timeout=30.0)
         
-        create_table_query = f"""CREATE TABLE IF NOT EXISTS {CONFIG['channel']} (
-                                client_id TEXT PRIMARY KEY NOT NULL,
-                                long_name TEXT,
-                                short_name TEXT,
-                                macaddr TEXT,
-                                latitude_i TEXT,
-                                longitude_i TEXT,
-                                altitude TEXT,
-                                precision_bits TEXT,
-                                last_updated TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                            )"""
-        
-        cursor.execute(create_table_query)
-        db_connection.commit()
+        try:
+            configure_connection(connection)
+            
+            connection.execute(node_table_ddl(NODE_TABLE, if_not_exists=True))
+            connection.commit()
+            
+            migrate_node_table_without_rowid(connection)
+        finally:
+            connection.close()
         
         logging.info(f"Database setup completed successfully: {CONFIG['database_file']}")
         return True
@@ -267,94 +465,212 @@ def setup_database():
         logging.error(f"Unexpected error during database setup: {e}")
         return False
 
-def decode_encrypted(message_packet, encryption_key):
-    """Decode encrypted message with enhanced error handling"""
+def queue_db_write(sql, params):
+    """Queue a write statement for the database writer thread"""
     try:
-        logging.debug("Starting message decryption...")
-        
-        # Validate input
-        if not hasattr(message_packet, 'encrypted') or not message_packet.encrypted:
+        db_write_queue.put_nowait((sql, params))
+    except queue.Full:
+        logging.warning(f"Database write queue full ({CONFIG['db_queue_size']} pending), dropping write")
+
+def collect_db_batch():
+    """Wait for queued writes and collect up to db_batch_size of them"""
+    batch_size = CONFIG["db_batch_size"]
+    batch_interval = CONFIG["db_batch_interval_ms"] / 1000
+    
+    try:
+        batch = [db_write_queue.get(timeout=batch_interval)]
+    except queue.Empty:
+        return []
+    
+    deadline = time.monotonic() + batch_interval
+    while len(batch) < batch_size:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            break
+        try:
+            batch.append(db_write_queue.get(timeout=remaining))
+        except queue.Empty:
+            break
+    
+    return batch
+
+def write_db_batch(batch):
+    """Apply a batch of writes inside a single transaction"""
+    try:
+        # Take the write lock up front rather than upgrading mid-transaction
+        db_connection.execute("BEGIN IMMEDIATE")
+        # Consecutive writes sharing a statement go through one executemany call
+        for sql, group in itertools.groupby(batch, key=lambda item: item[0]):
+            db_connection.executemany(sql, [params for _, params in group])
+        db_connection.execute("COMMIT")
+        logging.debug("Committed %d database writes", len(batch))
+    except sqlite3.Error as e:
+        logging.error(f"Database batch write failed ({len(batch)} statements): {e}")
+        try:
+            if db_connection.in_transaction:
+                db_connection.execute("ROLLBACK")
+        except sqlite3.Error as e:
+            logging.error(f"Database rollback failed: {e}")
+
+def database_writer():
+    """Own the write connection and apply queued writes until shutdown"""
+    global db_connection
+    
+    try:
+        # Autocommit mode, transactions are managed explicitly per batch
+        db_connection = sqlite3.connect(
+            CONFIG["database_file"],
+            timeout=30.0,
+            isolation_level=None,
+            cached_statements=DB_CACHED_STATEMENTS
+        )
+        configure_connection(db_connection)
+    except sqlite3.Error as e:
+        logging.error(f"Failed to open database writer connection: {e}")
+        return
+    
+    logging.info("Database writer started")
+    
+    try:
+        # Keep draining after stop is requested so queued writes are not lost
+        while not (db_writer_stop.is_set() and db_write_queue.empty()):
+            # A failed batch is logged and skipped; the writer keeps running
+            try:
+                batch = collect_db_batch()
+                if batch:
+                    write_db_batch(batch)
+            except Exception as e:
+                logging.error(f"Unexpected error in database writer: {e}")
+    finally:
+        db_connection.close()
+        db_connection = None
+        logging.info("Database writer stopped")
+
+def start_database_writer():
+    """Start the database writer thread"""
+    global db_writer_thread
+    
+    db_writer_thread = threading.Thread(target=database_writer, name="db-writer")
+    db_writer_thread.start()
+
+def decrypt_packet(pkt_id, pkt_from, encrypted):
+    """Decrypt a MeshPacket payload and return (portnum, payload)
+
+    Kept free of logging and exception handling; errors propagate to the caller.
+    """
+    decryptor = Cipher(
+        AES_ALGORITHM, 
+        modes.CTR(NONCE_STRUCT.pack(pkt_id, pkt_from)), 
+        backend=CRYPTO_BACKEND
+    ).decryptor()
+    
+    # Decrypt into a reused buffer; update_into needs block_size - 1 bytes of headroom
+    plain_buf = getattr(_tls, "plain_buf", None)
+    if plain_buf is None or len(plain_buf) < len(encrypted) + 15:
+        plain_buf = _tls.plain_buf = bytearray(max(1024, len(encrypted) + 16))
+    decrypted_len = decryptor.update_into(encrypted, plain_buf)
+    decryptor.finalize()
+    
+    # Parse decrypted data into a reused message
+    data = getattr(_tls, "data", None)
+    if data is None:
+        data = _tls.data = mesh_pb2.Data()
+    data.Clear()
+    data.MergeFromString(memoryview(plain_buf)[:decrypted_len])
+    
+    return data.portnum, data.payload
+
+def decode_encrypted(message_packet):
+    """Decrypt an encrypted message and dispatch its payload"""
+    try:
+        encrypted = message_packet.encrypted
+        if not encrypted:
             logging.warning("No encrypted data found in message packet")
             return False
         
-        if not hasattr(message_packet, 'id') or not hasattr(message_packet, 'from'):
-            logging.warning("Missing required fields for decryption")
-            return False
+        # "from" is a Python keyword, so resolve it (and the id) once
+        pkt_id = message_packet.id
+        pkt_from = getattr(message_packet, "from")
         
-        # Prepare decryption
-        key_bytes = base64.b64decode(encryption_key.encode("ascii"))
+        portnum, payload = decrypt_packet(pkt_id, pkt_from, encrypted)
         
-        nonce_packet_id = getattr(message_packet, "id").to_bytes(8, "little")
-        nonce_from_node = getattr(message_packet, "from").to_bytes(8, "little")
-        nonce = nonce_packet_id + nonce_from_node
+        client_id = create_node_id(pkt_from)
         
-        logging.debug(f"Decryption nonce prepared (length: {len(nonce)})")
+        if portnum not in HANDLED_PORTNUMS:
+            logging.debug("Ignoring unhandled portnum %s from %s", portnum, client_id)
+            return True
         
-        # Decrypt
-        cipher = Cipher(
-            algorithms.AES(key_bytes), 
-            modes.CTR(nonce), 
-            backend=default_backend()
-        )
-        decryptor = cipher.decryptor()
-        decrypted_bytes = (
-            decryptor.update(getattr(message_packet, "encrypted"))
-            + decryptor.finalize()
-        )
-        
-        # Parse decrypted data
-        data = mesh_pb2.Data()
-        data.ParseFromString(decrypted_bytes)
-        message_packet.decoded.CopyFrom(data)
-        
-        client_id = create_node_id(getattr(message_packet, "from", None))
-        logging.info(f"Successfully decoded message from: {client_id}")
+        logging.info("Successfully decoded message from: %s", client_id)
         
         # Process text messages
-        if message_packet.decoded.portnum == portnums_pb2.TEXT_MESSAGE_APP:
+        if portnum == TEXT_MESSAGE_APP:
+            if is_duplicate_message(pkt_id, pkt_from):
+                logging.info(f"Skipping duplicate message {pkt_id} from {client_id}")
+                return True
+            
+            text_payload = payload.decode("utf-8")
+            logging.info("Text message content: %.100s...", text_payload)  # Log first 100 chars
+            
+            # Hand off to the DAPNET worker, which handles retries
             try:
-                text_payload = message_packet.decoded.payload.decode("utf-8")
-                logging.info(f"Text message content: {text_payload[:100]}...")  # Log first 100 chars
-                
-                # Send to DAPNET with retry
-                send_to_dapnet_pocsag(text_payload, client_id)
-                
-            except UnicodeDecodeError as e:
-                logging.error(f"Failed to decode text payload: {e}")
-            except Exception as e:
-                logging.error(f"Error processing text message: {e}")
+                dapnet_queue.put_nowait((text_payload, client_id))
+            except queue.Full:
+                # Not forwarded after all, so a later rebroadcast copy may still be paged
+                forget_message(pkt_id, pkt_from)
+                raise
+            if logging.getLogger().isEnabledFor(logging.DEBUG):
+                logging.debug("Queued message for DAPNET (pending: %d)", dapnet_queue.qsize())
+        
+        # Store node details and positions
+        elif portnum == NODEINFO_APP:
+            store_node_info(client_id, payload)
+        elif portnum == POSITION_APP:
+            store_position(client_id, payload)
         
         return True
         
+    except UnicodeDecodeError as e:
+        logging.error(f"Failed to decode text payload: {e}")
+        return False
+    except queue.Full:
+        logging.error(f"DAPNET queue full ({CONFIG['dapnet_queue_size']} pending), dropping message from {client_id}")
+        return False
     except Exception as e:
         logging.error(f"Decryption failed: {e}")
-        logging.debug(f"Message packet details: {message_packet}")
+        if logging.getLogger().isEnabledFor(logging.DEBUG):
+            # Formatting a protobuf message is expensive, only do it when it will be logged
+            logging.debug("Message packet details: %s", message_packet)
         return False
 
+@functools.lru_cache(maxsize=256)
+def encode_dapnet_payload(text_payload):
+    """Encode the DAPNET call body, cached for repeated texts"""
+    return orjson.dumps({
+        "text": text_payload,
+        "callSignNames": [CONFIG["callsign"]],
+        "transmitterGroupNames": [CONFIG["transmitter_group"]],
+        "emergency": False
+    })
+
 def send_to_dapnet_pocsag(text_payload, client_id, max_retries=None):
     """Send message to DAPNET with retry mechanism"""
     if max_retries is None:
         max_retries = CONFIG["max_retries"]
     
-    payload = {
-        "text": text_payload,
-        "callSignNames": [CONFIG["callsign"]],
-        "transmitterGroupNames": [CONFIG["transmitter_group"]],
-        "emergency": False
-    }
+    # Encoded once and reused across attempts; the session sends Content-Type: application/json
+    body = encode_dapnet_payload(text_payload)
     
     for attempt in range(max_retries):
+        if shutdown_event.is_set():
+            logging.warning(f"Shutdown requested, abandoning DAPNET send from {client_id}")
+            return False
+        
         try:
             logging.info(f"Sending to DAPNET (attempt {attempt + 1}/{max_retries}): {text_payload[:50]}... from {client_id}")
             
-            auth = (CONFIG["callsign"], CONFIG["dapnet_password"])
-            headers = {"Content-Type": "application/json"}
-            
-            response = requests.post(
+            response = DAPNET_SESSION.post(
                 CONFIG["dapnet_api_url"], 
-                auth=auth, 
-                headers=headers, 
-                json=payload,
+                data=body,
                 timeout=CONFIG["api_timeout"]
             )
             
@@ -376,20 +692,84 @@ def send_to_dapnet_pocsag(text_payload, client_id, max_retries=None):
         if attempt < max_retries - 1:
             sleep_time = CONFIG["retry_delay"] * (2 ** attempt)  # Exponential backoff
             logging.info(f"Retrying in {sleep_time} seconds...")
-            time.sleep(sleep_time)
+            if shutdown_event.wait(sleep_time):
+                logging.warning(f"Shutdown requested, abandoning DAPNET send from {client_id}")
+                return False
     
     logging.error(f"Failed to send message to DAPNET after {max_retries} attempts")
     return False
 
+def store_node_info(client_id, payload):
+    """Queue an upsert of a node's names from a NODEINFO_APP payload"""
+    user = getattr(_tls, "user", None)
+    if user is None:
+        user = _tls.user = mesh_pb2.User()
+    user.Clear()
+    user.MergeFromString(payload)
+    queue_db_write(
+        UPSERT_NODEINFO_SQL,
+        (client_id, user.long_name, user.short_name, user.macaddr.hex(":"))
+    )
+    logging.debug("Queued node info update for %s: %s", client_id, user.long_name)
+
+def store_position(client_id, payload):
+    """Queue an upsert of a node's position from a POSITION_APP payload"""
+    position = getattr(_tls, "position", None)
+    if position is None:
+        position = _tls.position = mesh_pb2.Position()
+    position.Clear()
+    position.MergeFromString(payload)
+    queue_db_write(
+        UPSERT_POSITION_SQL,
+        (client_id, position.latitude_i, position.longitude_i,
+         position.altitude, position.precision_bits)
+    )
+    logging.debug("Queued position update for %s", client_id)
+
+def is_duplicate_message(packet_id, node_number):
+    """Check whether a packet was already forwarded within SEEN_MESSAGES_TTL"""
+    key = (packet_id, node_number)
+    now = time.monotonic()
+    
+    with seen_messages_lock:
+        seen_at = seen_messages.get(key)
+        if seen_at is not None and now - seen_at < SEEN_MESSAGES_TTL:
+            return True
+        
+        seen_messages[key] = now
+        seen_messages.move_to_end(key)
+        if len(seen_messages) > SEEN_MESSAGES_MAX:
+            seen_messages.popitem(last=False)
+    
+    return False
+
+def forget_message(packet_id, node_number):
+    """Drop a packet from the forwarded set so a later copy is not treated as a duplicate"""
+    with seen_messages_lock:
+        seen_messages.pop((packet_id, node_number), None)
+
+def dapnet_worker():
+    """Deliver queued messages to DAPNET in the background"""
+    logging.info("DAPNET worker started")
+    
+    while not shutdown_event.is_set():
+        try:
+            text_payload, client_id = dapnet_queue.get(timeout=1)
+        except queue.Empty:
+            continue
+        
+        try:
+            send_to_dapnet_pocsag(text_payload, client_id)
+        except Exception as e:
+            logging.error(f"Unexpected error in DAPNET worker: {e}")
+        finally:
+            dapnet_queue.task_done()
+    
+    logging.info("DAPNET worker stopped")
+
 def create_node_id(node_number):
-    """Create node ID with validation"""
-    try:
-        if node_number is None:
-            return "!unknown"
-        return f"!{hex(node_number)[2:]}"
-    except Exception as e:
-        logging.error(f"Error creating node ID: {e}")
-        return "!error"
+    """Create node ID from a node number"""
+    return f"!{node_number:x}"
 
 def on_connect(client, userdata, flags, rc, properties=None):
     """Enhanced MQTT connection callback - compatible with both v1 and v2 API"""
@@ -397,8 +777,8 @@ def on_connect(client, userdata, flags, rc, properties=None):
         if rc == 0:
             logging.info(f"Successfully connected to MQTT broker: {CONFIG['mqtt_broker']}")
             
-            # Subscribe to topic
-            subscribe_topic = f"{CONFIG['root_topic']}{CONFIG['channel']}/#"
+            # Subscribe to envelope topics only, optionally for a single gateway, so the broker drops the rest
+            subscribe_topic = f"{CONFIG['root_topic']}{CONFIG['channel']}/{CONFIG['gateway_id'] or '+'}"
             result = client.subscribe(subscribe_topic, 0)
             
             if result[0] == mqtt.MQTT_ERR_SUCCESS:
@@ -436,42 +816,67 @@ def on_disconnect(client, userdata, rc, properties=None, reasonCode=None):
 def on_message(client, userdata, msg):
     """Enhanced message processing with comprehensive error handling"""
     try:
-        logging.debug(f"Received MQTT message on topic: {msg.topic}")
+        logging.debug("Received MQTT message on topic: %s", msg.topic)
+        
+        # Envelopes are published under .../<channel>/!<gateway id>; skip anything else
+        if not msg.topic.rpartition("/")[2].startswith("!"):
+            logging.debug("Ignoring message on non-gateway topic: %s", msg.topic)
+            return
         
-        # Parse service envelope
-        service_envelope = mqtt_pb2.ServiceEnvelope()
+        # Parse, decrypt and dispatch on the worker pool, shedding load once it falls behind
+        if not worker_slots.acquire(blocking=False):
+            logging.warning(f"Worker queue full ({CONFIG['worker_queue_size']} pending), dropping packet")
+            return
+        try:
+            message_workers.submit(process_packet, msg.topic, msg.payload)
+        except Exception:
+            worker_slots.release()
+            raise
+            
+    except Exception as e:
+        logging.error(f"Critical error in message processing: {e}")
+        logging.debug("Message details - Topic: %s, Payload length: %d", msg.topic, len(msg.payload))
+
+def process_packet(topic, payload):
+    """Parse, decrypt and dispatch a ServiceEnvelope on a worker thread"""
+    try:
+        # Parse service envelope into a reused message
+        service_envelope = getattr(_tls, "service_envelope", None)
+        if service_envelope is None:
+            service_envelope = _tls.service_envelope = mqtt_pb2.ServiceEnvelope()
         try:
-            service_envelope.ParseFromString(msg.payload)
+            service_envelope.Clear()
+            service_envelope.MergeFromString(payload)
         except Exception as e:
             logging.error(f"Failed to parse ServiceEnvelope: {e}")
             return
         
         # Extract message packet
-        if not hasattr(service_envelope, 'packet'):
+        if not service_envelope.HasField("packet"):
             logging.warning("ServiceEnvelope missing packet field")
             return
             
         message_packet = service_envelope.packet
-        logging.debug(f"Message packet from node: {getattr(message_packet, 'from', 'unknown')}")
+        if logging.getLogger().isEnabledFor(logging.DEBUG):
+            logging.debug("Message packet from node: %s", getattr(message_packet, "from"))
         
-        # Process broadcast messages
-        if hasattr(message_packet, 'to') and message_packet.to == BROADCAST_NUM:
-            logging.debug("Processing broadcast message")
-            
-            if (hasattr(message_packet, 'encrypted') and 
-                message_packet.HasField("encrypted") and 
-                not message_packet.HasField("decoded")):
-                
-                logging.debug("Processing encrypted message")
-                decode_encrypted(message_packet, encryption_key)
-            else:
-                logging.debug("Received non-encrypted broadcast message")
-        else:
+        # Only encrypted broadcast messages are processed
+        if message_packet.to != BROADCAST_NUM:
             logging.debug("Ignoring non-broadcast message")
+            return
+        
+        if not message_packet.HasField("encrypted") or message_packet.HasField("decoded"):
+            logging.debug("Received non-encrypted broadcast message")
+            return
+        
+        logging.debug("Processing encrypted broadcast message")
+        decode_encrypted(message_packet)
             
     except Exception as e:
         logging.error(f"Critical error in message processing: {e}")
-        logging.debug(f"Message details - Topic: {msg.topic}, Payload length: {len(msg.payload)}")
+        logging.debug("Message details - Topic: %s, Payload length: %d", topic, len(payload))
+    finally:
+        worker_slots.release()
 
 def setup_mqtt_client():
     """Setup MQTT client with enhanced error handling"""
@@ -511,6 +916,10 @@ def connect_mqtt_with_retry():
     max_retries = CONFIG["max_retries"]
     
     for attempt in range(max_retries):
+        if shutdown_event.is_set():
+            logging.info("Shutdown requested, stopping MQTT connection attempts")
+            return False
+        
         try:
             logging.info(f"Attempting MQTT connection (attempt {attempt + 1}/{max_retries})...")
             
@@ -532,7 +941,9 @@ def connect_mqtt_with_retry():
         if attempt < max_retries - 1:
             sleep_time = CONFIG["retry_delay"] * (2 ** attempt)
             logging.info(f"Retrying MQTT connection in {sleep_time} seconds...")
-            time.sleep(sleep_time)
+            if shutdown_event.wait(sleep_time):
+                logging.info("Shutdown requested, stopping MQTT connection attempts")
+                return False
     
     logging.critical(f"Failed to connect to MQTT broker after {max_retries} attempts")
     return False
@@ -542,6 +953,9 @@ def signal_handler(signum, frame):
     if signum == signal.SIGINT:
         print("\nCtrl+C pressed - Shutting down immediately!")
         logging.info("SIGINT received - Immediate shutdown")
+        # os._exit skips atexit, so flush queued log records to their handlers first
+        if log_listener:
+            log_listener.stop()
         os._exit(0)  # Immediate exit without cleanup
     else:
         logging.info(f"Received signal {signum}, initiating graceful shutdown...")
@@ -549,11 +963,14 @@ def signal_handler(signum, frame):
 
 def cleanup_resources():
     """Clean up resources before exit"""
-    global mqtt_client, db_connection
+    global mqtt_client
     
     try:
         logging.info("Cleaning up resources...")
         
+        # Signal background workers to finish
+        shutdown_event.set()
+        
         # Disconnect MQTT client
         if mqtt_client:
             try:
@@ -563,13 +980,44 @@ def cleanup_resources():
             except Exception as e:
                 logging.error(f"Error disconnecting MQTT client: {e}")
         
-        # Close database connection
-        if db_connection:
+        # Stop packet workers, dropping anything not yet started
+        if message_workers:
+            try:
+                message_workers.shutdown(wait=True, cancel_futures=True)
+                logging.info("Message workers stopped")
+            except Exception as e:
+                logging.error(f"Error stopping message workers: {e}")
+        
+        # Let the DAPNET worker finish its in-flight send before the session is closed
+        if dapnet_thread:
+            try:
+                dapnet_thread.join(timeout=CONFIG["api_timeout"] + 5)
+                if dapnet_thread.is_alive():
+                    logging.warning("DAPNET worker did not stop in time")
+                undelivered = dapnet_queue.qsize()
+                if undelivered:
+                    logging.warning(f"{undelivered} queued DAPNET message(s) were not delivered")
+            except Exception as e:
+                logging.error(f"Error stopping DAPNET worker: {e}")
+        
+        # Close DAPNET HTTP session
+        try:
+            DAPNET_SESSION.close()
+            logging.info("DAPNET session closed")
+        except Exception as e:
+            logging.error(f"Error closing DAPNET session: {e}")
+        
+        # Let the database writer flush pending writes and close its connection
+        if db_writer_thread:
             try:
-                db_connection.close()
-                logging.info("Database connection closed")
+                db_writer_stop.set()
+                db_writer_thread.join(timeout=10)
+                if db_writer_thread.is_alive():
+                    logging.warning("Database writer did not stop in time")
+                else:
+                    logging.info("Database writer flushed and closed")
             except Exception as e:
-                logging.error(f"Error closing database connection: {e}")
+                logging.error(f"Error stopping database writer: {e}")
         
         logging.info("Resource cleanup completed")
         
@@ -578,21 +1026,40 @@ def cleanup_resources():
 
 def main_loop():
     """Main application loop with enhanced error handling"""
-    global mqtt_client
+    global mqtt_client, db_write_queue, message_workers, worker_slots, dapnet_queue, dapnet_thread
     
     try:
         logging.info("Starting main application loop...")
         
+        # Start database writer before any messages arrive
+        db_write_queue = queue.Queue(maxsize=CONFIG["db_queue_size"])
+        start_database_writer()
+        
+        # Create the DAPNET queue before anything can be decoded
+        dapnet_queue = queue.Queue(maxsize=CONFIG["dapnet_queue_size"])
+        
+        # Start packet workers before MQTT messages can arrive
+        worker_slots = threading.BoundedSemaphore(CONFIG["worker_queue_size"])
+        message_workers = ThreadPoolExecutor(
+            max_workers=CONFIG["worker_threads"],
+            thread_name_prefix="msh"
+        )
+        
         # Start MQTT loop in background
         mqtt_client.loop_start()
         
-        # Start periodic log check in background
-        log_check_thread = threading.Thread(target=periodic_log_check, daemon=True)
-        log_check_thread.start()
+        # Start DAPNET delivery in background
+        dapnet_thread = threading.Thread(target=dapnet_worker, name="dapnet", daemon=True)
+        dapnet_thread.start()
         
         # Main monitoring loop
         while not shutdown_event.is_set():
             try:
+                # Restart the database writer if it died, e.g. because its connection failed to open
+                if not db_writer_thread.is_alive():
+                    logging.error("Database writer stopped unexpectedly, restarting...")
+                    start_database_writer()
+                
                 # Check MQTT client status
                 if not mqtt_client.is_connected():
                     logging.warning("MQTT client disconnected, attempting reconnection...")
@@ -600,8 +1067,8 @@ def main_loop():
                         logging.critical("Failed to reconnect to MQTT broker")
                         break
                 
-                # Health check interval
-                time.sleep(10)
+                # Health check interval; returns early once shutdown is requested
+                shutdown_event.wait(10)
                 
             except KeyboardInterrupt:
                 # This should not be reached due to signal handler, but just in case
@@ -609,7 +1076,7 @@ def main_loop():
                 break
             except Exception as e:
                 logging.error(f"Error in main loop: {e}")
-                time.sleep(5)  # Brief pause before continuing
+                shutdown_event.wait(5)  # Brief pause before continuing
         
         logging.info("Main loop ended")
         
@@ -623,20 +1090,30 @@ def print_config_summary():
     logging.info("Configuration Summary:")
     logging.info(f"  MQTT Broker: {CONFIG['mqtt_broker']}:{CONFIG['mqtt_port']}")
     logging.info(f"  MQTT Topic: {CONFIG['root_topic']}{CONFIG['channel']}")
+    logging.info(f"  Gateway Filter: {CONFIG['gateway_id'] or 'all gateways'}")
     logging.info(f"  MQTT Username: {CONFIG['mqtt_username']}")
     logging.info(f"  DAPNET API: {CONFIG['dapnet_api_url']}")
     logging.info(f"  Callsign: {CONFIG['callsign']}")
     logging.info(f"  Transmitter Group: {CONFIG['transmitter_group']}")
     logging.info(f"  Database File: {CONFIG['database_file']}")
+    logging.info(f"  DB Batch: {CONFIG['db_batch_size']} writes / {CONFIG['db_batch_interval_ms']}ms")
+    logging.info(f"  DB Queue Size: {CONFIG['db_queue_size']}")
     logging.info(f"  Log File: {CONFIG['log_file']}")
+    logging.info(f"  Log Level: {CONFIG['log_level']}")
     logging.info(f"  Max Retries: {CONFIG['max_retries']}")
     logging.info(f"  Retry Delay: {CONFIG['retry_delay']}s")
     logging.info(f"  API Timeout: {CONFIG['api_timeout']}s")
+    logging.info(f"  Worker Threads: {CONFIG['worker_threads']}")
+    logging.info(f"  Worker Queue Size: {CONFIG['worker_queue_size']}")
+    logging.info(f"  DAPNET Queue Size: {CONFIG['dapnet_queue_size']}")
+    logging.info(f"  Handled Payloads: {', '.join(CONFIG['handle_portnums'])}")
+    logging.info(f"  Protobuf Backend: {api_implementation.Type()}")
+    
+    if api_implementation.Type() not in ("upb", "cpp"):
+        logging.warning("Protobuf is using the slow pure-Python backend, upgrade protobuf for faster packet parsing")
 
 def main():
     """Main function with comprehensive initialization"""
-    global encryption_key
-    
     try:
         # Setup signal handlers - IMMEDIATE EXIT for Ctrl+C
         signal.signal(signal.SIGINT, signal_handler)   # Ctrl+C - immediate exit
@@ -661,7 +1138,8 @@ def main():
             sys.exit(1)
         
         # Prepare encryption key
-        encryption_key = prepare_encryption_key()
+        prepare_encryption_key()
+        prepare_portnum_filter()
         
         # Setup database
         if not setup_database():